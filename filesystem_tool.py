@@ -3,18 +3,882 @@ import shutil
 import time
 import pickle
 import random
+import heapq
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, scrolledtext, simpledialog
 import subprocess
 import platform
+import sys
+import json
+import struct
+import socket
+import socketserver
+import threading
+import hashlib
+import mmap
+import stat
+import tempfile
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
+
+REPLICA_PORT = 8765
+BLOCK_SIZE = 4096
+CHUNK_SIZE = 64 * 1024
+PIPELINE_DEPTH = 32
+MAX_HEADER_SIZE = 16 * 1024 * 1024
+SIGNATURE_RECORD = struct.Struct("!IH16s")
+SIGNATURE_SECONDS_PER_MB = 0.1
+PARTIAL_HASH_SIZE = 4096
+HASH_READ_SIZE = 1024 * 1024
+FICLONE = 0x40049409
+MAINTENANCE_BANDWIDTH = 20 * 1024 * 1024
+MAINTENANCE_IOPS = 400
+MAINTENANCE_TARGET_LATENCY = 0.02
+MAINTENANCE_MIN_FACTOR = 0.05
+MAINTENANCE_PROBE_INTERVAL = 0.5
+MAINTENANCE_SYNC_SIZE = 8 * 1024 * 1024
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "riscv64": 30,
+    "armv7l": 314, "ppc64le": 273, "ppc64": 273, "s390x": 282,
+}
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity else rate
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        # Goes into debt for oversized requests and sleeps it off, so the
+        # long-run rate holds even when single writes exceed the capacity.
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def set_rate(self, rate):
+        with self.lock:
+            now = time.monotonic()
+            if self.rate:
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.rate = rate
+            self.capacity = rate
+            self.tokens = min(self.tokens, self.capacity) if rate else 0
+
+def send_message(sock, header, payload=b"", bucket=None):
+    header = dict(header, size=len(payload))
+    data = json.dumps(header).encode("utf-8")
+    if bucket is not None:
+        bucket.consume(4 + len(data) + len(payload))
+    sock.sendall(struct.pack("!I", len(data)) + data)
+    if payload:
+        sock.sendall(payload)
+
+def recv_exact(sock, count):
+    buf = bytearray()
+    while len(buf) < count:
+        chunk = sock.recv(min(count - len(buf), 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Connection closed by peer.")
+        buf.extend(chunk)
+    return bytes(buf)
+
+def recv_message(sock):
+    (length,) = struct.unpack("!I", recv_exact(sock, 4))
+    if length > MAX_HEADER_SIZE:
+        raise ValueError("Message header too large.")
+    header = json.loads(recv_exact(sock, length).decode("utf-8"))
+    size = header.get("size", 0)
+    payload = recv_exact(sock, size) if size else b""
+    return header, payload
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def checksum_parts(block):
+    # rsync weak checksum: a is the byte sum, b the sum of the running sums.
+    return sum(block), sum(accumulate(block))
+
+def weak_checksum(a, b):
+    return ((b & 0xffff) << 16) | (a & 0xffff)
+
+def block_signatures(files, block_size):
+    records = bytearray()
+    layout = []
+    index = 0
+    for f in files:
+        first = index
+        f.seek(0)
+        for block in iter(lambda: f.read(block_size), b""):
+            a, b = checksum_parts(block)
+            records += SIGNATURE_RECORD.pack(weak_checksum(a, b), len(block),
+                                             hashlib.md5(block).digest())
+            index += 1
+        layout.append((first, index - first))
+    return bytes(records), layout
+
+def parse_signatures(payload):
+    table = {}
+    for index, (weak, length, strong) in enumerate(SIGNATURE_RECORD.iter_unpack(payload)):
+        table.setdefault(weak, []).append((index, length, strong))
+    return table
+
+def compute_delta(data, block_size, table):
+    # Yields ("c", block_index, length) for data the receiver already has and
+    # ("l", bytes) for literal data.
+    n = len(data)
+    if not table:
+        for offset in range(0, n, CHUNK_SIZE):
+            yield ("l", data[offset:offset + CHUNK_SIZE])
+        return
+    strong_index = {}
+    for entries in table.values():
+        for index, length, strong in entries:
+            strong_index.setdefault((strong, length), index)
+    md5 = hashlib.md5
+    lookup = table.get
+    pos = literal_start = 0
+    while pos < n:
+        # The block at the current offset is tried first, so unchanged and
+        # appended regions match without any per-byte work.
+        length = min(block_size, n - pos)
+        match = strong_index.get((md5(data[pos:pos + length]).digest(), length))
+        if match is None:
+            # Fall back to rolling the weak checksum one byte at a time until
+            # some block matches again, e.g. after an insertion.
+            a, b = checksum_parts(data[pos:pos + length])
+            while match is None:
+                out = data[pos]
+                if pos + length < n:
+                    a = a - out + data[pos + length]
+                    b = b - length * out + a
+                else:
+                    a -= out
+                    b -= length * out
+                    length -= 1
+                pos += 1
+                if pos >= n:
+                    break
+                if pos - literal_start >= CHUNK_SIZE:
+                    yield ("l", data[literal_start:pos])
+                    literal_start = pos
+                candidates = lookup(((b & 0xffff) << 16) | (a & 0xffff))
+                if candidates:
+                    for index, block_len, strong in candidates:
+                        if block_len == length and md5(data[pos:pos + length]).digest() == strong:
+                            match = index
+                            break
+            if match is None:
+                break
+        if literal_start < pos:
+            yield ("l", data[literal_start:pos])
+        yield ("c", match, length)
+        pos += length
+        literal_start = pos
+    if literal_start < n:
+        yield ("l", data[literal_start:n])
+
+class ReplicaHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.basis = {}
+        self.incoming = None
+        try:
+            while True:
+                try:
+                    header, payload = recv_message(self.request)
+                except (OSError, ValueError):
+                    break
+                op = header.get("op")
+                if op == "sig":
+                    self.handle_sig(header)
+                elif op == "begin":
+                    self.handle_begin(header)
+                elif op == "delta":
+                    self.handle_delta(header, payload)
+                elif op == "end":
+                    self.handle_end(header)
+                elif op == "get":
+                    self.handle_get(header)
+                else:
+                    send_message(self.request, {"op": "error", "error": f"Unknown operation '{op}'."})
+        except OSError as e:
+            print(f"Replica connection error: {e}")
+        finally:
+            self.abort_incoming()
+            for _, _, files in self.basis.values():
+                for f in files:
+                    f.close()
+
+    def handle_sig(self, header):
+        name = header.get("name")
+        try:
+            path = self.server.replica_path(name)
+            block_size = int(header.get("block_size", BLOCK_SIZE))
+            if not 512 <= block_size <= 65535:
+                raise ValueError(f"Invalid block size {block_size}.")
+            if name in self.basis:
+                for f in self.basis.pop(name)[2]:
+                    f.close()
+            # Unchanged files are answered before any signature work.
+            if header.get("md5") and header["md5"] == self.server.replica_digest(path):
+                send_message(self.request, {"op": "unchanged", "name": name})
+                return
+            # A partial file left by an interrupted transfer is offered as
+            # basis alongside the old replica, so resent data becomes copies.
+            # The basis is read through handles opened under the name lock,
+            # so other connections committing the same name cannot change it.
+            files = []
+            with self.server.name_lock(name):
+                for basis_path in (path + ".partial", path):
+                    if os.path.isfile(basis_path):
+                        files.append(open(basis_path, "rb"))
+            self.basis[name] = (block_size, [], files)
+            records, layout = block_signatures(files, block_size)
+            self.basis[name] = (block_size, layout, files)
+        except (ValueError, OSError) as e:
+            send_message(self.request, {"op": "error", "name": name, "error": str(e)})
+            return
+        send_message(self.request, {"op": "sig", "name": name, "block_size": block_size}, records)
+
+    def handle_begin(self, header):
+        self.abort_incoming()
+        name = header.get("name")
+        self.incoming = {"name": name, "file": None, "md5": hashlib.md5(), "error": None}
+        try:
+            path = self.server.replica_path(name)
+            # Each connection stages into its own file, so concurrent pushes
+            # of the same name never interleave.
+            fd, staging_path = tempfile.mkstemp(prefix=name + ".", suffix=".incoming",
+                                                dir=self.server.root_dir)
+            self.incoming["path"] = path
+            self.incoming["staging"] = staging_path
+            self.incoming["file"] = os.fdopen(fd, "wb")
+        except (ValueError, OSError) as e:
+            self.incoming["error"] = str(e)
+
+    def handle_delta(self, header, payload):
+        incoming = self.incoming
+        if incoming is None or incoming["error"]:
+            return
+        try:
+            block_size, layout, files = self.basis.get(incoming["name"], (BLOCK_SIZE, [], []))
+            offset = 0
+            for kind, value in header.get("ops", []):
+                if kind == "c":
+                    data = self.read_block(layout, files, block_size, value)
+                else:
+                    data = payload[offset:offset + value]
+                    offset += value
+                incoming["file"].write(data)
+                incoming["md5"].update(data)
+        except (ValueError, OSError) as e:
+            incoming["error"] = str(e)
+
+    def read_block(self, layout, files, block_size, index):
+        for (first, count), f in zip(layout, files):
+            if first <= index < first + count:
+                f.seek((index - first) * block_size)
+                return f.read(block_size)
+        raise ValueError(f"Unknown basis block {index}.")
+
+    def handle_end(self, header):
+        incoming, self.incoming = self.incoming, None
+        if incoming is None:
+            send_message(self.request, {"op": "error", "error": "No transfer in progress."})
+            return
+        name = incoming["name"]
+        error = incoming["error"]
+        if incoming["file"] is not None:
+            incoming["file"].close()
+        for f in self.basis.pop(name, (None, None, []))[2]:
+            f.close()
+        if not error and incoming["md5"].hexdigest() != header.get("md5"):
+            error = "Checksum mismatch after reconstruction."
+        try:
+            if error:
+                if incoming["file"] is not None:
+                    os.remove(incoming["staging"])
+            else:
+                path = incoming["path"]
+                if header.get("mtime"):
+                    os.utime(incoming["staging"], (header["mtime"], header["mtime"]))
+                with self.server.name_lock(name):
+                    os.replace(incoming["staging"], path)
+                    if os.path.exists(path + ".partial"):
+                        os.remove(path + ".partial")
+                    st = os.stat(path)
+                    self.server.digests[path] = ((st.st_size, st.st_mtime_ns), header.get("md5"))
+        except OSError as e:
+            error = str(e)
+        if error:
+            send_message(self.request, {"op": "error", "name": name, "error": error})
+        else:
+            send_message(self.request, {"op": "ok", "name": name})
+
+    def abort_incoming(self):
+        # Keep whatever was reconstructed so the next attempt can resume.
+        incoming, self.incoming = self.incoming, None
+        if incoming is None or incoming["file"] is None:
+            return
+        incoming["file"].close()
+        staging_path = incoming["staging"]
+        try:
+            if not incoming["error"] and os.path.getsize(staging_path) > 0:
+                with self.server.name_lock(incoming["name"]):
+                    os.replace(staging_path, incoming["path"] + ".partial")
+            else:
+                os.remove(staging_path)
+        except OSError as e:
+            print(f"Error saving partial transfer: {e}")
+
+    def handle_get(self, header):
+        name = header.get("name")
+        try:
+            path = self.server.replica_path(name)
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"Replica of '{name}' not found.")
+            offset = int(header.get("offset", 0))
+            bucket = TokenBucket(header["bwlimit"]) if header.get("bwlimit") else None
+            with open(path, "rb") as f:
+                total = os.fstat(f.fileno()).st_size
+                digest = file_md5(path)
+                send_message(self.request, {"op": "file", "name": name, "total": total,
+                                            "md5": digest, "mtime": os.path.getmtime(path)})
+                f.seek(min(offset, total))
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    send_message(self.request, {"op": "chunk"}, chunk, bucket)
+            send_message(self.request, {"op": "eof", "name": name})
+        except (ValueError, OSError) as e:
+            send_message(self.request, {"op": "error", "name": name, "error": str(e)})
+
+class ReplicaServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, root_dir, host="127.0.0.1", port=REPLICA_PORT):
+        self.root_dir = os.path.abspath(root_dir)
+        os.makedirs(self.root_dir, exist_ok=True)
+        self.thread = None
+        self.name_locks = {}
+        self.name_locks_lock = threading.Lock()
+        self.digests = {}
+        super().__init__((host, port), ReplicaHandler)
+
+    def replica_digest(self, path):
+        # md5 of the stored replica, cached by size and mtime so repeated
+        # replication of unchanged files does not re-read them.
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = (st.st_size, st.st_mtime_ns)
+        cached = self.digests.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        digest = file_md5(path)
+        self.digests[path] = (key, digest)
+        return digest
+
+    def name_lock(self, name):
+        # Held only around opening the basis and committing, never across
+        # network I/O, so connections pipelining many names cannot deadlock.
+        with self.name_locks_lock:
+            return self.name_locks.setdefault(name, threading.Lock())
+
+    def replica_path(self, name):
+        if (not isinstance(name, str) or name in ("", ".", "..")
+                or name != os.path.basename(name)
+                or name.endswith((".partial", ".incoming"))):
+            raise ValueError(f"Invalid backup name '{name}'.")
+        return os.path.join(self.root_dir, name)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self.server_address
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+class ReplicationClient:
+    def __init__(self, host, port=REPLICA_PORT, bwlimit=None, block_size=BLOCK_SIZE, timeout=30):
+        self.host = host
+        self.port = port
+        self.bwlimit = bwlimit
+        self.bucket = TokenBucket(bwlimit) if bwlimit else None
+        self.block_size = block_size
+        self.timeout = timeout
+        self.sock = None
+        self.stats = {"literal_bytes": 0, "matched_bytes": 0}
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        return self
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def push_files(self, paths):
+        # Files are handled in pipelined batches over the one connection:
+        # all signature requests go out first, then all deltas, then the acks
+        # are collected, so no file waits on a round trip of its own.
+        results = {}
+        for start in range(0, len(paths), PIPELINE_DEPTH):
+            batch = paths[start:start + PIPELINE_DEPTH]
+            digests = [file_md5(path) for path in batch]
+            for path, digest in zip(batch, digests):
+                send_message(self.sock, {"op": "sig", "name": os.path.basename(path),
+                                         "block_size": self.block_size, "md5": digest})
+            # The server builds each file's signatures before replying, so the
+            # wait for a reply grows with file size.
+            largest = max(os.path.getsize(path) for path in batch)
+            self.sock.settimeout(self.timeout + largest / (1024 * 1024) * SIGNATURE_SECONDS_PER_MB)
+            try:
+                replies = [recv_message(self.sock) for _ in batch]
+            finally:
+                self.sock.settimeout(self.timeout)
+            pending = []
+            for path, digest, (header, payload) in zip(batch, digests, replies):
+                name = os.path.basename(path)
+                if header.get("op") == "unchanged":
+                    results[name] = "unchanged"
+                    continue
+                if header.get("op") != "sig":
+                    results[name] = header.get("error", "failed")
+                    continue
+                self.send_delta(path, name, header["block_size"], payload, digest)
+                pending.append(name)
+            for name in pending:
+                header, _ = recv_message(self.sock)
+                results[name] = "sent" if header.get("op") == "ok" else header.get("error", "failed")
+        return results
+
+    def send_delta(self, path, name, block_size, signatures, digest):
+        table = parse_signatures(signatures)
+        send_message(self.sock, {"op": "begin", "name": name})
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+            try:
+                ops = []
+                literal = bytearray()
+                for op in compute_delta(data, block_size, table):
+                    if op[0] == "c":
+                        ops.append(("c", op[1]))
+                        self.stats["matched_bytes"] += op[2]
+                    else:
+                        ops.append(("l", len(op[1])))
+                        literal += op[1]
+                        self.stats["literal_bytes"] += len(op[1])
+                    if len(literal) >= CHUNK_SIZE or len(ops) >= 4096:
+                        send_message(self.sock, {"op": "delta", "ops": ops}, bytes(literal), self.bucket)
+                        ops = []
+                        literal = bytearray()
+                if ops:
+                    send_message(self.sock, {"op": "delta", "ops": ops}, bytes(literal), self.bucket)
+            finally:
+                if size:
+                    data.close()
+        send_message(self.sock, {"op": "end", "name": name, "md5": digest,
+                                 "mtime": os.path.getmtime(path)})
+
+    def fetch_file(self, name, dest_path):
+        # Downloads resume from dest_path.partial if an earlier pull was cut off.
+        partial_path = dest_path + ".partial"
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        send_message(self.sock, {"op": "get", "name": name, "offset": offset,
+                                 "bwlimit": self.bwlimit})
+        header, _ = recv_message(self.sock)
+        if header.get("op") != "file":
+            raise FileNotFoundError(header.get("error", f"Replica of '{name}' not found."))
+        if offset > header["total"]:
+            offset = 0
+        with open(partial_path, "r+b" if offset else "wb") as f:
+            f.seek(offset)
+            f.truncate()
+            while True:
+                chunk_header, chunk = recv_message(self.sock)
+                if chunk_header.get("op") == "eof":
+                    break
+                if chunk_header.get("op") != "chunk":
+                    raise IOError(chunk_header.get("error", "Transfer failed."))
+                f.write(chunk)
+        if file_md5(partial_path) != header["md5"]:
+            os.remove(partial_path)
+            raise IOError(f"Checksum mismatch fetching '{name}' from replica.")
+        os.replace(partial_path, dest_path)
+        os.utime(dest_path, (header["mtime"], header["mtime"]))
+        return True
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if size < 1024 or unit == "TB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def hash_file(path, partial_size=None):
+    # With partial_size set only the head and tail of the file are hashed;
+    # files small enough to be covered completely get their full hash.
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                size = len(view)
+                if partial_size is not None and size > 2 * partial_size:
+                    digest.update(view[:partial_size])
+                    digest.update(view[-partial_size:])
+                else:
+                    for offset in range(0, size, HASH_READ_SIZE):
+                        digest.update(view[offset:offset + HASH_READ_SIZE])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+def reflink_file(source_path, dest_path):
+    # dest_path must not exist; it is created exclusively and removed again
+    # if the clone fails, so an existing file is never truncated.
+    if fcntl is None or not hasattr(fcntl, "ioctl"):
+        raise OSError("Reflinks are not supported on this platform.")
+    with open(source_path, "rb") as src:
+        fd = os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(fd, FICLONE, src.fileno())
+        except OSError:
+            os.close(fd)
+            os.remove(dest_path)
+            raise
+        os.close(fd)
+
+def clone_to_temp(source_path, dest_path, mode):
+    # Hardlinks or reflinks source_path to a fresh name next to dest_path,
+    # retrying on name collisions so existing files are never touched.
+    dest_dir, name = os.path.split(dest_path)
+    for _ in range(100):
+        temp_path = tempfile.mktemp(prefix=f".{name}.", suffix=".dedup-tmp", dir=dest_dir)
+        try:
+            if mode == "hardlink":
+                os.link(source_path, temp_path)
+            else:
+                reflink_file(source_path, temp_path)
+            return temp_path
+        except FileExistsError:
+            continue
+    raise FileExistsError(f"Could not create a temporary file next to '{dest_path}'.")
+
+def disk_usage(st):
+    # Allocated size where the platform reports it, like du; apparent size otherwise.
+    blocks = getattr(st, "st_blocks", None)
+    return blocks * 512 if blocks is not None else st.st_size
+
+def scan_directory(dir_path, cached):
+    # Reuses the cached listing while the directory mtime is unchanged, so
+    # only directories whose entries changed are read again.
+    try:
+        mtime_ns = os.stat(dir_path).st_mtime_ns
+        if cached is not None and cached["mtime_ns"] == mtime_ns:
+            return dir_path, cached, False
+        files = []
+        dirs = []
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    else:
+                        st = entry.stat(follow_symlinks=False)
+                        files.append((entry.name, disk_usage(st), st.st_dev, st.st_ino, st.st_nlink))
+                except OSError:
+                    continue
+        return dir_path, {"mtime_ns": mtime_ns, "files": files, "dirs": dirs}, True
+    except OSError as e:
+        print(f"Error scanning '{dir_path}': {e}")
+        return dir_path, None, False
+
+def set_idle_io_priority():
+    # ioprio_set(IOPRIO_WHO_PROCESS, 0, ...) applies to the calling thread on Linux.
+    syscall_nr = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if ctypes is None or not sys.platform.startswith("linux") or syscall_nr is None:
+        return False
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        result = libc.syscall(syscall_nr, IOPRIO_WHO_PROCESS, 0,
+                              IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT)
+    except (OSError, AttributeError):
+        return False
+    return result == 0
+
+def device_io_counters(dev):
+    # Completed I/Os and milliseconds spent on them for one block device.
+    try:
+        major, minor = os.major(dev), os.minor(dev)
+        with open("/proc/diskstats") as f:
+            for line in f:
+                fields = line.split()
+                if int(fields[0]) == major and int(fields[1]) == minor:
+                    return int(fields[3]) + int(fields[7]), int(fields[6]) + int(fields[10])
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        pass
+    return None
+
+def drop_page_cache(fd, offset, length):
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+class SourcePageCache:
+    # Snapshots which pages of the source were resident before the copy
+    # started (mincore(2) on a private mapping that is never touched), so only
+    # pages the copy or its readahead brought in are dropped. Without mincore
+    # nothing is dropped, leaving hot pages alone.
+    def __init__(self, fd):
+        self.fd = fd
+        self.resident = None
+        if ctypes is None or not sys.platform.startswith("linux") or not hasattr(os, "posix_fadvise"):
+            return
+        try:
+            size = os.fstat(fd).st_size
+            if not size:
+                return
+            libc = ctypes.CDLL(None, use_errno=True)
+            mm = mmap.mmap(fd, size, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError, AttributeError):
+            return
+        vec = (ctypes.c_ubyte * ((size + mmap.PAGESIZE - 1) // mmap.PAGESIZE))()
+        buf = ctypes.c_char.from_buffer(mm)
+        try:
+            if libc.mincore(ctypes.c_void_p(ctypes.addressof(buf)), ctypes.c_size_t(size), vec) == 0:
+                self.resident = bytes(vec)
+        finally:
+            del buf
+            mm.close()
+
+    def drop_new(self, offset, length):
+        if self.resident is None:
+            return
+        first = offset // mmap.PAGESIZE
+        last = min(len(self.resident), (offset + length + mmap.PAGESIZE - 1) // mmap.PAGESIZE)
+        run_start = None
+        for page in range(first, last + 1):
+            cold = page < last and not self.resident[page] & 1
+            if cold and run_start is None:
+                run_start = page
+            elif not cold and run_start is not None:
+                drop_page_cache(self.fd, run_start * mmap.PAGESIZE, (page - run_start) * mmap.PAGESIZE)
+                run_start = None
+
+class MaintenanceCancelled(Exception):
+    pass
+
+class MaintenanceScheduler:
+    def __init__(self, bandwidth=MAINTENANCE_BANDWIDTH, iops=MAINTENANCE_IOPS,
+                 target_latency=MAINTENANCE_TARGET_LATENCY):
+        self.bandwidth = bandwidth
+        self.iops = iops
+        self.target_latency = target_latency
+        self.byte_bucket = TokenBucket(bandwidth)
+        self.op_bucket = TokenBucket(iops)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.factor = 1.0
+        self.latency = None
+        self.probe_dev = None
+        self.probe_counters = None
+        self.probe_time = 0
+        self.current_task = None
+        self.idle_priority = False
+        self.totals = {"bytes": 0, "ops": 0, "throttled_seconds": 0.0, "backoffs": 0, "tasks": 0}
+
+    def configure(self, bandwidth=None, iops=None, target_latency=None):
+        with self.lock:
+            if bandwidth is not None:
+                self.bandwidth = bandwidth
+            if iops is not None:
+                self.iops = iops
+            if target_latency is not None:
+                self.target_latency = target_latency
+            self.apply_rates()
+
+    def apply_rates(self):
+        self.byte_bucket.set_rate(self.bandwidth * self.factor if self.bandwidth else None)
+        self.op_bucket.set_rate(self.iops * self.factor if self.iops else None)
+
+    def submit(self, name, func, *args):
+        return self.executor.submit(self.run_task, name, func, *args)
+
+    def run_task(self, name, func, *args):
+        if self.cancelled.is_set():
+            raise MaintenanceCancelled(f"Maintenance task '{name}' cancelled.")
+        # The worker thread drops itself to the idle I/O class, so the kernel
+        # only serves maintenance I/O when the disk is otherwise idle.
+        self.idle_priority = set_idle_io_priority()
+        with self.lock:
+            self.current_task = name
+            self.totals["tasks"] += 1
+        try:
+            return func(*args)
+        finally:
+            with self.lock:
+                self.current_task = None
+
+    def shutdown(self):
+        # The worker is joined at interpreter exit, so a throttled copy must
+        # stop between chunks rather than run to completion.
+        self.cancelled.set()
+        try:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        except TypeError:
+            self.executor.shutdown(wait=False)
+
+    def throttle(self, nbytes, ops=1):
+        self.sample_latency()
+        waited = self.byte_bucket.consume(nbytes) + self.op_bucket.consume(ops)
+        with self.lock:
+            self.totals["bytes"] += nbytes
+            self.totals["ops"] += ops
+            self.totals["throttled_seconds"] += waited
+
+    def sample_latency(self):
+        now = time.monotonic()
+        if self.probe_dev is None or now - self.probe_time < MAINTENANCE_PROBE_INTERVAL:
+            return
+        self.probe_time = now
+        counters = device_io_counters(self.probe_dev)
+        previous, self.probe_counters = self.probe_counters, counters
+        if counters is None or previous is None or counters[0] <= previous[0]:
+            return
+        self.report_latency((counters[1] - previous[1]) / (counters[0] - previous[0]) / 1000)
+
+    def report_latency(self, latency):
+        # AIMD: halve the rates while the smoothed device latency is above
+        # target, then creep back up once it recovers.
+        with self.lock:
+            self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+            if self.latency > self.target_latency:
+                self.factor = max(MAINTENANCE_MIN_FACTOR, self.factor / 2)
+                self.totals["backoffs"] += 1
+            else:
+                self.factor = min(1.0, self.factor + 0.1)
+            self.apply_rates()
+
+    def copy_file(self, source_path, dest_path):
+        # The copy is slow by design, so it goes to a temporary file that only
+        # replaces dest_path once complete and on disk; the previous copy stays
+        # intact until then.
+        dest_dir, name = os.path.split(dest_path)
+        fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".backup-tmp", dir=dest_dir)
+        try:
+            with os.fdopen(fd, "wb") as dst:
+                self.copy_contents(source_path, dst)
+            shutil.copystat(source_path, temp_path)
+            os.replace(temp_path, dest_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def copy_contents(self, source_path, dst):
+        sync = getattr(os, "fdatasync", os.fsync)
+        with open(source_path, "rb") as src:
+            dev = os.fstat(src.fileno()).st_dev
+            if dev != self.probe_dev:
+                self.probe_dev = dev
+                self.probe_counters = None
+            offset = synced = 0
+            source_cache = SourcePageCache(src.fileno())
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                if self.cancelled.is_set():
+                    raise MaintenanceCancelled(f"Copy of '{source_path}' cancelled.")
+                self.throttle(len(chunk), ops=2)
+                dst.write(chunk)
+                offset += len(chunk)
+                # Written pages can only be dropped once they are clean.
+                if hasattr(os, "posix_fadvise") and offset - synced >= MAINTENANCE_SYNC_SIZE:
+                    dst.flush()
+                    sync(dst.fileno())
+                    drop_page_cache(dst.fileno(), synced, offset - synced)
+                    source_cache.drop_new(synced, offset - synced)
+                    synced = offset
+            # Pages still under readahead I/O at a sync point are skipped by
+            # the kernel, so the cold pages of the whole file are swept again.
+            source_cache.drop_new(0, offset)
+            dst.flush()
+            sync(dst.fileno())
+            if offset > synced:
+                drop_page_cache(dst.fileno(), synced, offset - synced)
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                self.totals,
+                task=self.current_task,
+                bandwidth_limit=self.bandwidth * self.factor if self.bandwidth else None,
+                iops_limit=self.iops * self.factor if self.iops else None,
+                throttle_factor=self.factor,
+                latency=self.latency,
+                target_latency=self.target_latency,
+                io_priority="idle" if self.idle_priority else "default",
+                drops_page_cache=hasattr(os, "posix_fadvise"),
+            )
 
 class FileSystem:
     def __init__(self):
         self.current_dir = os.getcwd()
         self.journal_file = os.path.join(self.current_dir, "filesystem_journal.log")
+        self.hash_index_file = os.path.join(self.current_dir, "filesystem_hashes.log")
+        self.usage_cache_file = os.path.join(self.current_dir, "filesystem_usage.log")
         self.backup_dir = os.path.join(self.current_dir, "backup")
         self.cache = {}
+        self.hash_index = {}
+        self.usage_cache = {}
+        self.maintenance = MaintenanceScheduler()
+        self.replica = None
+        self.replica_bwlimit = None
         self.load_journal()
+        self.load_hash_index()
+        self.load_usage_cache()
         self.create_backup_dir()
 
     def create_backup_dir(self):
@@ -37,6 +901,39 @@ class FileSystem:
         with open(self.journal_file, "wb") as f:
             pickle.dump(self.cache, f)
 
+    def internal_paths(self):
+        return {os.path.abspath(p) for p in (self.backup_dir, self.journal_file,
+                                             self.hash_index_file, self.usage_cache_file)}
+
+    def load_hash_index(self):
+        # Maps path -> (size, mtime_ns, inode, partial hash, full hash) so
+        # rescans only hash files whose metadata changed.
+        self.hash_index = {}
+        if os.path.exists(self.hash_index_file):
+            try:
+                with open(self.hash_index_file, "rb") as f:
+                    self.hash_index = pickle.load(f)
+            except (pickle.PickleError, EOFError):
+                print("Hash index corrupted, starting fresh.")
+
+    def save_hash_index(self):
+        with open(self.hash_index_file, "wb") as f:
+            pickle.dump(self.hash_index, f)
+
+    def load_usage_cache(self):
+        # Maps directory path -> listing keyed by the directory's mtime.
+        self.usage_cache = {}
+        if os.path.exists(self.usage_cache_file):
+            try:
+                with open(self.usage_cache_file, "rb") as f:
+                    self.usage_cache = pickle.load(f)
+            except (pickle.PickleError, EOFError):
+                print("Disk usage cache corrupted, starting fresh.")
+
+    def save_usage_cache(self):
+        with open(self.usage_cache_file, "wb") as f:
+            pickle.dump(self.usage_cache, f)
+
     def create_file(self, file_path, content):
         try:
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
@@ -148,6 +1045,238 @@ class FileSystem:
             print(f"Error listing directory: {e}")
             return []
 
+    def find_duplicates(self, path=None, workers=None):
+        target_dir = os.path.abspath(path if path else self.current_dir)
+        if not os.path.isdir(target_dir):
+            raise NotADirectoryError(f"'{target_dir}' is not a directory.")
+        skip = self.internal_paths()
+        by_size = {}
+        inode_paths = {}
+        scanned = 0
+        for dirpath, dirnames, filenames in os.walk(target_dir):
+            dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) not in skip]
+            for name in filenames:
+                file_path = os.path.join(dirpath, name)
+                if file_path in skip:
+                    continue
+                try:
+                    st = os.lstat(file_path)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                    continue
+                scanned += 1
+                # Paths that are already hardlinks of each other are hashed
+                # and counted once, but all of them are relinked on dedup.
+                links = inode_paths.setdefault((st.st_dev, st.st_ino), [])
+                links.append(file_path)
+                if len(links) == 1:
+                    by_size.setdefault(st.st_size, []).append((file_path, st))
+
+        stats = {"hashed_bytes": 0}
+        lock = threading.Lock()
+
+        def cached_hash(item, full):
+            file_path, st = item
+            entry = self.hash_index.get(file_path)
+            if entry is None or entry[:3] != (st.st_size, st.st_mtime_ns, st.st_ino):
+                entry = (st.st_size, st.st_mtime_ns, st.st_ino, None, None)
+            field = 4 if full else 3
+            if entry[field] is None:
+                try:
+                    digest = hash_file(file_path, None if full else PARTIAL_HASH_SIZE)
+                except (IOError, OSError, ValueError) as e:
+                    print(f"Error hashing '{file_path}': {e}")
+                    return None
+                entry = entry[:field] + (digest,) + entry[field + 1:]
+                if not full and st.st_size <= 2 * PARTIAL_HASH_SIZE:
+                    entry = entry[:4] + (digest,)
+                with lock:
+                    stats["hashed_bytes"] += st.st_size if full else min(st.st_size, 2 * PARTIAL_HASH_SIZE)
+            with lock:
+                self.hash_index[file_path] = entry
+            return entry[field]
+
+        def refine(groups, full):
+            items = [item for group in groups for item in group]
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                digests = list(pool.map(lambda item: cached_hash(item, full), items))
+            refined = {}
+            for item, digest in zip(items, digests):
+                if digest is not None:
+                    refined.setdefault((item[1].st_size, digest), []).append(item)
+            return {key: group for key, group in refined.items() if len(group) > 1}
+
+        candidates = [group for group in by_size.values() if len(group) > 1]
+        partial_groups = refine(candidates, full=False)
+        full_groups = refine(partial_groups.values(), full=True)
+
+        groups = []
+        for (size, digest), items in full_groups.items():
+            paths = []
+            for file_path, st in items:
+                for link_path in inode_paths[(st.st_dev, st.st_ino)]:
+                    self.hash_index[link_path] = self.hash_index[file_path]
+                    paths.append(link_path)
+            groups.append({"size": size, "hash": digest, "copies": len(items), "paths": sorted(paths)})
+        groups.sort(key=lambda g: g["size"] * (g["copies"] - 1), reverse=True)
+        reclaimable = sum(g["size"] * (g["copies"] - 1) for g in groups)
+        for cached_path in list(self.hash_index):
+            if cached_path.startswith(target_dir + os.sep) and not os.path.exists(cached_path):
+                del self.hash_index[cached_path]
+        self.save_hash_index()
+        print(f"Scanned {scanned} files, hashed {format_size(stats['hashed_bytes'])}: "
+              f"{len(groups)} duplicate groups, {format_size(reclaimable)} reclaimable.")
+        return {"groups": groups, "reclaimable": reclaimable, "scanned": scanned,
+                "hashed_bytes": stats["hashed_bytes"]}
+
+    def unchanged_since_scan(self, path):
+        # Returns the lstat result only if path still matches its scan-time entry.
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return None
+        entry = self.hash_index.get(path)
+        if entry is None or entry[:3] != (st.st_size, st.st_mtime_ns, st.st_ino):
+            return None
+        return st
+
+    def deduplicate(self, groups, mode="hardlink"):
+        if mode not in ("hardlink", "reflink"):
+            raise ValueError(f"Unknown deduplication mode '{mode}'.")
+        result = {"replaced": 0, "reclaimed": 0, "failed": 0, "skipped": 0}
+        for group in groups:
+            # Only files unchanged since the scan take part, the kept copy
+            # included. Like hardlink(1), hardlinks only join files with the
+            # same mode and owner, since a link shares both.
+            classes = {}
+            for path in group["paths"]:
+                st = self.unchanged_since_scan(path)
+                if st is None:
+                    print(f"Skipping '{path}': file changed since scan.")
+                    result["skipped"] += 1
+                    continue
+                key = (st.st_mode, st.st_uid, st.st_gid) if mode == "hardlink" else None
+                classes.setdefault(key, []).append(path)
+            for paths in classes.values():
+                if len(paths) < 2:
+                    if len(classes) > 1:
+                        print(f"Skipping '{paths[0]}': mode or owner differs from its duplicates.")
+                        result["skipped"] += 1
+                    continue
+                self.replace_duplicates(paths[0], paths[1:], group["size"], mode, result)
+        self.save_hash_index()
+        print(f"Replaced {result['replaced']} duplicates with {mode}s, "
+              f"reclaimed {format_size(result['reclaimed'])}, skipped {result['skipped']}.")
+        return result
+
+    def replace_duplicates(self, keep, dups, size, mode, result):
+        for dup in dups:
+            temp_path = None
+            try:
+                if os.path.samefile(keep, dup):
+                    continue
+                st = os.lstat(dup)
+                temp_path = clone_to_temp(keep, dup, mode)
+                if mode == "reflink":
+                    shutil.copystat(dup, temp_path)
+                    temp_st = os.lstat(temp_path)
+                    if (temp_st.st_uid, temp_st.st_gid) != (st.st_uid, st.st_gid):
+                        os.chown(temp_path, st.st_uid, st.st_gid)
+                # Re-check both files right before the swap to narrow the
+                # window for a concurrent writer.
+                if self.unchanged_since_scan(keep) is None or self.unchanged_since_scan(dup) is None:
+                    raise IOError("file changed since scan")
+                os.replace(temp_path, dup)
+                temp_path = None
+                new_st = os.lstat(dup)
+                self.hash_index[dup] = (new_st.st_size, new_st.st_mtime_ns, new_st.st_ino) + \
+                    self.hash_index[dup][3:]
+                result["replaced"] += 1
+                if st.st_nlink == 1:
+                    result["reclaimed"] += size
+            except (IOError, OSError) as e:
+                # Only the temporary file created above is ever removed.
+                if temp_path is not None:
+                    try:
+                        os.remove(temp_path)
+                    except OSError:
+                        pass
+                print(f"Error deduplicating '{dup}': {e}")
+                result["failed"] += 1
+
+    def analyze_disk_usage(self, path=None, top_n=20, workers=None, refresh=False):
+        target_dir = os.path.abspath(path if path else self.current_dir)
+        if not os.path.isdir(target_dir):
+            raise NotADirectoryError(f"'{target_dir}' is not a directory.")
+        # Cached listings miss files that grow in place without touching the
+        # directory mtime; refresh bypasses the cache and rereads everything.
+        cache = {} if refresh else self.usage_cache
+        entries = {}
+        rescanned = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = {pool.submit(scan_directory, target_dir, cache.get(target_dir))}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir_path, entry, changed = future.result()
+                    if entry is None:
+                        continue
+                    entries[dir_path] = entry
+                    rescanned += changed
+                    for name in entry["dirs"]:
+                        sub_path = os.path.join(dir_path, name)
+                        pending.add(pool.submit(scan_directory, sub_path, cache.get(sub_path)))
+
+        for cached_path in list(self.usage_cache):
+            if (cached_path == target_dir or cached_path.startswith(target_dir + os.sep)) \
+                    and cached_path not in entries:
+                del self.usage_cache[cached_path]
+        self.usage_cache.update(entries)
+        self.save_usage_cache()
+
+        # Hardlinked files are charged once, to the first path in sorted order.
+        dirs = {}
+        seen_inodes = set()
+        all_files = []
+        for dir_path in sorted(entries):
+            entry = entries[dir_path]
+            files = []
+            for name, usage, dev, ino, nlink in entry["files"]:
+                if nlink > 1 and ino:
+                    if (dev, ino) in seen_inodes:
+                        usage = 0
+                    seen_inodes.add((dev, ino))
+                files.append((usage, name))
+                all_files.append((usage, os.path.join(dir_path, name)))
+            dirs[dir_path] = {
+                "size": sum(usage for usage, _ in files),
+                "file_count": len(files),
+                "files": sorted(files, reverse=True),
+                "subdirs": [os.path.join(dir_path, d) for d in entry["dirs"]
+                            if os.path.join(dir_path, d) in entries],
+            }
+        for dir_path in sorted(dirs, key=lambda p: p.count(os.sep), reverse=True):
+            parent = os.path.dirname(dir_path)
+            if dir_path != target_dir and parent in dirs:
+                dirs[parent]["size"] += dirs[dir_path]["size"]
+                dirs[parent]["file_count"] += dirs[dir_path]["file_count"]
+        for info in dirs.values():
+            info["subdirs"].sort(key=lambda p: dirs[p]["size"], reverse=True)
+
+        total = dirs[target_dir]["size"] if target_dir in dirs else 0
+        print(f"Analyzed '{target_dir}': {format_size(total)} in {len(dirs)} directories "
+              f"({rescanned} rescanned).")
+        return {
+            "root": target_dir,
+            "total": total,
+            "dirs": dirs,
+            "rescanned": rescanned,
+            "largest_files": heapq.nlargest(top_n, all_files),
+            "largest_dirs": heapq.nlargest(top_n, ((info["size"], p) for p, info in dirs.items()
+                                                   if p != target_dir)),
+        }
+
     def change_directory(self, path):
         if not os.path.exists(path):
             raise FileNotFoundError(f"Directory '{path}' not found.")
@@ -171,8 +1300,71 @@ class FileSystem:
             print(f"Error creating backup: {e}")
             return False
 
+    def configure_replica(self, host, port=REPLICA_PORT, bwlimit=None):
+        self.replica = (host, port)
+        self.replica_bwlimit = bwlimit
+        print(f"Replica set to {host}:{port}.")
+        return True
+
+    def replicate_backups(self):
+        if self.replica is None:
+            raise ValueError("No replica configured.")
+        paths = sorted(os.path.join(self.backup_dir, f) for f in os.listdir(self.backup_dir)
+                       if os.path.isfile(os.path.join(self.backup_dir, f))
+                       and not f.endswith((".partial", ".backup-tmp")))
+        try:
+            host, port = self.replica
+            with ReplicationClient(host, port, bwlimit=self.replica_bwlimit) as client:
+                results = client.push_files(paths)
+            for name, status in results.items():
+                print(f"Replicated '{name}': {status}.")
+            print(f"Replication sent {client.stats['literal_bytes']} literal bytes, "
+                  f"matched {client.stats['matched_bytes']} bytes.")
+            return results
+        except (IOError, OSError, ValueError) as e:
+            print(f"Error replicating backups: {e}")
+            return None
+
+    def fetch_from_replica(self, backup_name):
+        if self.replica is None:
+            raise ValueError("No replica configured.")
+        try:
+            host, port = self.replica
+            with ReplicationClient(host, port, bwlimit=self.replica_bwlimit) as client:
+                client.fetch_file(backup_name, os.path.join(self.backup_dir, backup_name))
+            print(f"Fetched '{backup_name}' from replica.")
+            return True
+        except (IOError, OSError, ValueError) as e:
+            print(f"Error fetching from replica: {e}")
+            return False
+
+    def backup_now(self, path=None, wait=True):
+        future = self.maintenance.submit("backup", self.run_backup, path)
+        return future.result() if wait else future
+
+    def run_backup(self, path=None):
+        target_dir = path if path else self.current_dir
+        skip = self.internal_paths()
+        count = 0
+        for name in os.listdir(target_dir):
+            file_path = os.path.join(target_dir, name)
+            if not os.path.isfile(file_path) or os.path.abspath(file_path) in skip:
+                continue
+            try:
+                self.maintenance.copy_file(file_path, os.path.join(self.backup_dir, name))
+                print(f"Backup created for '{file_path}'.")
+                count += 1
+            except (IOError, OSError) as e:
+                print(f"Error creating backup: {e}")
+        return count
+
+    def maintenance_stats(self):
+        return self.maintenance.stats()
+
     def restore_file(self, backup_name, restore_path=None):
         backup_path = os.path.join(self.backup_dir, backup_name)
+        if not os.path.exists(backup_path) and self.replica is not None:
+            self.fetch_from_replica(backup_name)
         if not os.path.exists(backup_path):
             raise FileNotFoundError(f"Backup for '{backup_name}' not found.")
         if restore_path is None:
@@ -216,7 +1408,11 @@ class FileSystem:
             print(f"Error simulating crash: {e}")
             return False
 
-    def defragment(self):
+    def defragment(self, wait=True):
+        future = self.maintenance.submit("defragment", self.run_defragment)
+        return future.result() if wait else future
+
+    def run_defragment(self):
         print("Defragmenting... This may take a while.")
         try:
             time.sleep(2)
@@ -233,6 +1429,11 @@ class FileSystemGUI:
         self.fs = FileSystem()
         self.setup_styles()
         self.create_widgets()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_close(self):
+        self.fs.maintenance.shutdown()
+        self.root.destroy()
 
     def setup_styles(self):
         self.style = ttk.Style()
@@ -315,6 +1516,7 @@ class FileSystemGUI:
         self.create_directory_operations_tab(notebook)
         self.create_advanced_operations_tab(notebook)
         self.create_recovery_tab(notebook)
+        self.create_disk_usage_tab(notebook)
         
         # Console
         console_frame = ttk.LabelFrame(
@@ -388,7 +1590,8 @@ class FileSystemGUI:
         buttons = [
             ('Copy File/Folder', self.copy_file_or_folder, 'Primary.TButton', '📋'),
             ('Open Folder', self.open_folder, 'Primary.TButton', '📂'),
-            ('Defragment', self.defragment, 'Primary.TButton', '🔧')
+            ('Defragment', self.defragment, 'Primary.TButton', '🔧'),
+            ('Find Duplicates', self.find_duplicates, 'Primary.TButton', '🔍')
         ]
         
         for i, (text, command, style, icon) in enumerate(buttons):
@@ -406,7 +1609,9 @@ class FileSystemGUI:
         buttons = [
             ('Simulate Crash', self.simulate_crash, 'Warning.TButton', '💥'),
             ('Restore File', self.restore_file, 'Success.TButton', '⏮️'),
-            ('Backup Now', self.backup_now, 'Primary.TButton', '💾')
+            ('Backup Now', self.backup_now, 'Primary.TButton', '💾'),
+            ('Replicate Backups', self.replicate_backups, 'Primary.TButton', '🛰️'),
+            ('Maintenance Status', self.maintenance_status, 'Primary.TButton', '📈')
         ]
         
         for i, (text, command, style, icon) in enumerate(buttons):
@@ -414,6 +1619,44 @@ class FileSystemGUI:
             btn.grid(row=0, column=i, padx=5, pady=5, sticky='ew')
             frame.grid_columnconfigure(i, weight=1)
 
+    def create_disk_usage_tab(self, notebook):
+        tab = ttk.Frame(notebook)
+        notebook.add(tab, text='📊 Disk Usage')
+        
+        frame = ttk.LabelFrame(tab, text='Disk Usage', style='Section.TLabelframe')
+        frame.pack(fill='both', expand=True, padx=5, pady=5)
+        
+        buttons = [
+            ('Analyze Directory', self.analyze_disk_usage, 'Primary.TButton', '📊'),
+            ('Analyze (full rescan)', lambda: self.analyze_disk_usage(refresh=True), 'Primary.TButton', '🔄')
+        ]
+        
+        for i, (text, command, style, icon) in enumerate(buttons):
+            btn = ttk.Button(frame, text=f"{icon} {text}", command=command, style=style)
+            btn.grid(row=0, column=i, padx=5, pady=5, sticky='ew')
+        
+        self.usage_tree = ttk.Treeview(frame, columns=('size', 'files'), height=8)
+        self.usage_tree.heading('#0', text='Name')
+        self.usage_tree.heading('size', text='Size')
+        self.usage_tree.heading('files', text='Files')
+        self.usage_tree.column('size', width=90, anchor='e')
+        self.usage_tree.column('files', width=70, anchor='e')
+        self.usage_tree.grid(row=1, column=0, padx=5, pady=5, sticky='nsew')
+        self.usage_tree.bind('<<TreeviewOpen>>', self.expand_usage_node)
+        
+        self.usage_top = ttk.Treeview(frame, columns=('size',), height=8)
+        self.usage_top.heading('#0', text='Largest Items')
+        self.usage_top.heading('size', text='Size')
+        self.usage_top.column('size', width=90, anchor='e')
+        self.usage_top.grid(row=1, column=1, padx=5, pady=5, sticky='nsew')
+        
+        frame.grid_rowconfigure(1, weight=1)
+        frame.grid_columnconfigure(0, weight=3)
+        frame.grid_columnconfigure(1, weight=2)
+        self.usage_report = None
+        self.usage_nodes = {}
+        self.usage_placeholders = set()
+
     def update_dir_label(self):
         self.dir_label.config(text=f"📁 Current Directory: {self.fs.current_dir}")
 
@@ -633,6 +1876,96 @@ class FileSystemGUI:
             except Exception as e:
                 messagebox.showerror("Error", str(e))
 
+    def find_duplicates(self):
+        dir_path = filedialog.askdirectory(
+            title="Select Directory to Scan",
+            initialdir=self.fs.current_dir
+        )
+        if not dir_path:
+            return
+        try:
+            self.console.insert(tk.END, f"Scanning '{dir_path}' for duplicates...\n")
+            self.root.update()
+            report = self.fs.find_duplicates(dir_path)
+            for group in report["groups"]:
+                self.console.insert(tk.END, f"{group['copies']} copies of {format_size(group['size'])}:\n")
+                for path in group["paths"]:
+                    self.console.insert(tk.END, f"- {path}\n")
+            self.console.insert(tk.END, f"Found {len(report['groups'])} duplicate groups, "
+                                        f"{format_size(report['reclaimable'])} reclaimable.\n")
+            if report["groups"] and messagebox.askyesno(
+                    "Deduplicate", "Replace duplicates with hardlinks to reclaim space?"):
+                result = self.fs.deduplicate(report["groups"])
+                self.console.insert(tk.END, f"Replaced {result['replaced']} duplicates, reclaimed "
+                                            f"{format_size(result['reclaimed'])}, {result['skipped']} skipped, "
+                                            f"{result['failed']} failed.\n")
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+
+    def analyze_disk_usage(self, refresh=False):
+        dir_path = filedialog.askdirectory(
+            title="Select Directory to Analyze",
+            initialdir=self.fs.current_dir
+        )
+        if not dir_path:
+            return
+        try:
+            self.console.insert(tk.END, f"Analyzing disk usage of '{dir_path}'...\n")
+            self.root.update()
+            report = self.fs.analyze_disk_usage(dir_path, refresh=refresh)
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.usage_report = report
+        self.usage_nodes = {}
+        self.usage_placeholders = set()
+        self.usage_tree.delete(*self.usage_tree.get_children())
+        self.usage_top.delete(*self.usage_top.get_children())
+        
+        if report["root"] in report["dirs"]:
+            root_node = self.insert_usage_dir('', report["root"], report["root"])
+            self.usage_tree.item(root_node, open=True)
+            self.populate_usage_node(root_node)
+        
+        files_node = self.usage_top.insert('', 'end', text='📄 Largest Files', open=True)
+        for size, path in report["largest_files"]:
+            self.usage_top.insert(files_node, 'end', text=path, values=(format_size(size),))
+        dirs_node = self.usage_top.insert('', 'end', text='📁 Largest Directories', open=True)
+        for size, path in report["largest_dirs"]:
+            self.usage_top.insert(dirs_node, 'end', text=path, values=(format_size(size),))
+        
+        self.console.insert(tk.END, f"Disk usage of '{report['root']}': {format_size(report['total'])} "
+                                    f"({report['rescanned']} directories rescanned).\n")
+
+    def insert_usage_dir(self, parent, path, label):
+        info = self.usage_report["dirs"][path]
+        node = self.usage_tree.insert(parent, 'end', text=f"📁 {label}",
+                                      values=(format_size(info["size"]), info["file_count"]))
+        self.usage_nodes[node] = path
+        if info["subdirs"] or info["files"]:
+            # Placeholder child so the node can be expanded; filled in on open.
+            self.usage_placeholders.add(self.usage_tree.insert(node, 'end', text='...'))
+        return node
+
+    def populate_usage_node(self, node):
+        path = self.usage_nodes.get(node)
+        children = self.usage_tree.get_children(node)
+        if path is None or len(children) != 1 or children[0] not in self.usage_placeholders:
+            return
+        self.usage_placeholders.discard(children[0])
+        self.usage_tree.delete(children[0])
+        info = self.usage_report["dirs"][path]
+        items = [(self.usage_report["dirs"][p]["size"], 0, p) for p in info["subdirs"]]
+        items += [(size, 1, name) for size, name in info["files"]]
+        for size, is_file, item in sorted(items, key=lambda i: i[0], reverse=True):
+            if is_file:
+                self.usage_tree.insert(node, 'end', text=f"📄 {item}", values=(format_size(size), ''))
+            else:
+                self.insert_usage_dir(node, item, os.path.basename(item))
+
+    def expand_usage_node(self, event):
+        self.populate_usage_node(self.usage_tree.focus())
+
     def change_directory(self):
         path = filedialog.askdirectory(
             title="Change Directory",
@@ -658,12 +1991,37 @@ class FileSystemGUI:
 
     def defragment(self):
         self.console.insert(tk.END, "Starting defragmentation...\n")
-        self.root.update()
-        success = self.fs.defragment()
-        if success:
-            self.console.insert(tk.END, "Defragmentation complete.\n")
-        else:
-            self.console.insert(tk.END, "Defragmentation failed.\n")
+        self.watch_maintenance(
+            self.fs.defragment(wait=False),
+            lambda success: "Defragmentation complete.\n" if success else "Defragmentation failed.\n"
+        )
+
+    def watch_maintenance(self, future, describe):
+        # Maintenance runs on the scheduler's worker thread; poll from the
+        # Tk loop so the window stays responsive while it is throttled.
+        if not future.done():
+            self.root.after(200, self.watch_maintenance, future, describe)
+            return
+        try:
+            self.console.insert(tk.END, describe(future.result()))
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+
+    def maintenance_status(self):
+        stats = self.fs.maintenance_stats()
+        bandwidth = f"{format_size(stats['bandwidth_limit'])}/s" if stats["bandwidth_limit"] else "unlimited"
+        iops = f"{stats['iops_limit']:.0f}" if stats["iops_limit"] else "unlimited"
+        latency = f"{stats['latency'] * 1000:.1f} ms" if stats["latency"] is not None else "not sampled"
+        lines = [
+            "Maintenance status:",
+            f"- Current task: {stats['task'] or 'idle'}",
+            f"- Bandwidth limit: {bandwidth}, IOPS limit: {iops}",
+            f"- Throttle factor: {stats['throttle_factor']:.2f} ({stats['backoffs']} backoffs)",
+            f"- Device latency: {latency} (target {stats['target_latency'] * 1000:.0f} ms)",
+            f"- I/O priority: {stats['io_priority']}, throttled {stats['throttled_seconds']:.1f} s, "
+            f"copied {format_size(stats['bytes'])}",
+        ]
+        self.console.insert(tk.END, "\n".join(lines) + "\n")
 
     def corrupt_file(self):
         file_path = filedialog.askopenfilename(
@@ -703,20 +2061,51 @@ class FileSystemGUI:
                     messagebox.showerror("Error", str(e))
 
     def backup_now(self):
-        try:
-            # Backup all files in current directory
-            files = [f for f in os.listdir(self.fs.current_dir) 
-                    if os.path.isfile(os.path.join(self.fs.current_dir, f))]
-            
-            for file in files:
-                file_path = os.path.join(self.fs.current_dir, file)
-                self.fs.backup_file(file_path)
-            
-            self.console.insert(tk.END, f"Backup completed for {len(files)} files.\n")
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+        self.console.insert(tk.END, "Starting background backup...\n")
+        self.watch_maintenance(
+            self.fs.backup_now(wait=False),
+            lambda count: f"Backup completed for {count} files.\n"
+        )
+
+    def replicate_backups(self):
+        if self.fs.replica is None:
+            address = simpledialog.askstring(
+                "Replica Server",
+                "Enter replica address (host:port):",
+                initialvalue=f"127.0.0.1:{REPLICA_PORT}"
+            )
+            if not address:
+                return
+            host, _, port = address.rpartition(":")
+            try:
+                self.fs.configure_replica(host or address, int(port) if host else REPLICA_PORT)
+            except ValueError:
+                messagebox.showerror("Error", f"Invalid replica address '{address}'.")
+                return
+        self.console.insert(tk.END, "Replicating backups...\n")
+        self.root.update()
+        results = self.fs.replicate_backups()
+        if results is None:
+            self.console.insert(tk.END, "Replication failed.\n")
+            return
+        for name, status in results.items():
+            self.console.insert(tk.END, f"- {name}: {status}\n")
+        self.console.insert(tk.END, f"Replication completed for {len(results)} files.\n")
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--replica-server":
+        # Usage: python filesystem_tool.py --replica-server [DIR] [PORT] [HOST]
+        replica_dir = sys.argv[2] if len(sys.argv) > 2 else "replica"
+        replica_port = int(sys.argv[3]) if len(sys.argv) > 3 else REPLICA_PORT
+        replica_host = sys.argv[4] if len(sys.argv) > 4 else "127.0.0.1"
+        server = ReplicaServer(replica_dir, replica_host, replica_port)
+        print(f"Replica server storing backups in '{server.root_dir}' on {replica_host}:{replica_port}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+        sys.exit(0)
+
     root = tk.Tk()
     
     # Window configuration